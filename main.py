@@ -1,223 +1,503 @@
-import os
-import discord
-from discord.ext import commands, tasks
-from datetime import datetime, timedelta, timezone
-from dotenv import load_dotenv
-
-load_dotenv()
-
-# Security configurations
-MAX_CHANNEL_CREATIONS = 1
-MAX_ROLE_CREATIONS = 1
-MAX_BAN_ATTEMPTS = 1
-MAX_KICK_ATTEMPTS = 1
-MAX_DELETIONS = 1
-ALERT_CHANNEL_NAME = "security-logs"
-BOT_INVITE_PROTECTION = True
-
-intents = discord.Intents.all()
-bot = commands.Bot(command_prefix='!', intents=intents)
-
-# Track permissions, activity, and whitelisted users
-original_permissions = {}
-user_activity = {}
-whitelisted_users = set()  # Store whitelisted user IDs
-
-async def backup_permissions(guild):
-    """Backup current permissions before making changes"""
-    original_permissions[guild.id] = {
-        'everyone': guild.default_role.permissions,
-        'channels': {
-            channel.id: channel.overwrites for channel in guild.text_channels
-        }
-    }
-
-async def restore_permissions(guild):
-    """Restore original permissions"""
-    if guild.id not in original_permissions:
-        return False
-    
-    try:
-        # Restore @everyone permissions
-        await guild.default_role.edit(
-            permissions=original_permissions[guild.id]['everyone']
-        )
-        
-        # Restore channel-specific permissions
-        for channel in guild.text_channels:
-            if channel.id in original_permissions[guild.id]['channels']:
-                await channel.edit(sync_permissions=True)
-                for target, overwrite in original_permissions[guild.id]['channels'][channel.id].items():
-                    await channel.set_permissions(target, overwrite=overwrite)
-        
-        return True
-    except Exception as e:
-        print(f"Restore failed: {e}")
-        return False
-
-async def get_alert_channel(guild):
-    """Get or create the alert channel"""
-    try:
-        alert_channel = discord.utils.get(guild.text_channels, name=ALERT_CHANNEL_NAME)
-        if not alert_channel:
-            overwrites = {
-                guild.default_role: discord.PermissionOverwrite(read_messages=False),
-                guild.me: discord.PermissionOverwrite(read_messages=True)
-            }
-            alert_channel = await guild.create_text_channel(
-                ALERT_CHANNEL_NAME,
-                overwrites=overwrites,
-                reason="Security alert channel"
-            )
-        return alert_channel
-    except Exception as e:
-        print(f"Error getting alert channel: {e}")
-        return None
-
-async def secure_ban_and_restore(guild, user, reason):
-    """Ban user and restore server permissions"""
-    if guild.id not in original_permissions or not original_permissions[guild.id]:
-        await backup_permissions(guild)
-
-    try:
-        # Ensure bot is allowed to ban
-        if user.top_role >= guild.me.top_role:
-            return False, "User has higher role than the bot"
-
-        await guild.ban(user, reason=reason)
-
-        # Restore permissions after ban
-        restore_success = await restore_permissions(guild)
-        return True, f"Banned successfully. Server {'restored' if restore_success else 'restore failed'}"
-    
-    except Exception as e:
-        return False, f"Error: {str(e)}"
-
-async def handle_suspicious_action(guild, user, action_type, target=None):
-    """Process suspicious actions with auto-ban"""
-    if user.id == guild.owner_id or user.id in whitelisted_users or user.top_role >= guild.me.top_role:
-        return  # Ignore actions from server owner, whitelisted users, or users with higher roles
-
-    alert_channel = await get_alert_channel(guild)
-
-    try:
-        # Send alert
-        if alert_channel:
-            embed = discord.Embed(
-                title="🚨 Suspicious Activity Detected",
-                description=f"Action: {action_type.replace('_', ' ').title()}",
-                color=discord.Color.red()
-            )
-            embed.add_field(name="User", value=f"{user.mention} ({user.id})")
-            await alert_channel.send(embed=embed)
-
-        # Ban the user
-        success, msg = await secure_ban_and_restore(guild, user, f"Suspicious: {action_type}")
-        if alert_channel:
-            await alert_channel.send(f"Action taken: {msg}")
-
-        # Delete suspicious channels/roles
-        if target and action_type.endswith("_create"):
-            try:
-                await target.delete(reason="Suspicious creation")
-            except:
-                pass
-
-    except Exception as e:
-        print(f"Error handling suspicious action: {e}")
-
-@bot.event
-async def on_guild_channel_create(channel):
-    async for entry in channel.guild.audit_logs(action=discord.AuditLogAction.channel_create, limit=1):
-        if entry.target.id == channel.id:
-            await handle_suspicious_action(channel.guild, entry.user, "channel_create", channel)
-            break
-
-@bot.event
-async def on_guild_channel_delete(channel):
-    async for entry in channel.guild.audit_logs(action=discord.AuditLogAction.channel_delete, limit=1):
-        if entry.target.id == channel.id:
-            await handle_suspicious_action(channel.guild, entry.user, "channel_delete")
-            break
-
-@bot.event
-async def on_guild_role_create(role):
-    async for entry in role.guild.audit_logs(action=discord.AuditLogAction.role_create, limit=1):
-        if entry.target.id == role.id:
-            await handle_suspicious_action(role.guild, entry.user, "role_create", role)
-            break
-
-@bot.event
-async def on_guild_role_delete(role):
-    async for entry in role.guild.audit_logs(action=discord.AuditLogAction.role_delete, limit=1):
-        if entry.target.id == role.id:
-            await handle_suspicious_action(role.guild, entry.user, "role_delete")
-            break
-
-@bot.event
-async def on_member_join(member):
-    if member.id == bot.user.id and BOT_INVITE_PROTECTION:
-        async for entry in member.guild.audit_logs(action=discord.AuditLogAction.bot_add, limit=1):
-            await handle_suspicious_action(member.guild, entry.user, "bot_add")
-            break
-
-@tasks.loop(minutes=30)
-async def cleanup_activity():
-    """Clean up old activity records"""
-    global user_activity
-    now = datetime.now(timezone.utc)
-    user_activity = {
-        user: {act: data for act, data in acts.items() 
-              if now - data['timestamp'] < timedelta(hours=1)}
-        for user, acts in list(user_activity.items())
-    }
-
-@bot.event
-async def on_ready():
-    print(f'Security bot {bot.user.name} is online!')
-    cleanup_activity.start()
-    await bot.change_presence(activity=discord.Activity(
-        type=discord.ActivityType.watching,
-        name="for suspicious activity"
-    ))
-
-# Whitelist command (Only Server Owner Can Use It)
-@bot.command(name='whitelist')
-async def whitelist(ctx, member: discord.Member):
-    if ctx.author.id != ctx.guild.owner_id:
-        await ctx.send("❌ Only the server owner can whitelist users!")
-        return
-    
-    whitelisted_users.add(member.id)
-    await ctx.send(f"✅ {member.mention} has been whitelisted!")
-
-# Unwhitelist command (Only Server Owner Can Use It)
-@bot.command(name='unwhitelist')
-async def unwhitelist(ctx, member: discord.Member):
-    if ctx.author.id != ctx.guild.owner_id:
-        await ctx.send("❌ Only the server owner can unwhitelist users!")
-        return
-    
-    whitelisted_users.discard(member.id)
-    await ctx.send(f"✅ {member.mention} has been removed from the whitelist!")
-
-# Manual unlock command for server owner
-@bot.command(name='unlock')
-async def manual_unlock(ctx):
-    """Manually restore server permissions"""
-    if ctx.author.id != ctx.guild.owner_id:
-        await ctx.send("❌ Only the server owner can unlock the server!")
-        return
-
-    success = await restore_permissions(ctx.guild)
-    
-    if success:
-        await ctx.send("✅ Server permissions restored!")
-    else:
-        await ctx.send("❌ Failed to restore permissions! Check the bot's role & permissions.")
-
-if __name__ == '__main__':
-    try:
-        bot.run(os.getenv('DISCORD_TOKEN'))
-    except Exception as e:
-        print(f"Fatal error: {e}")
+import asyncio
+import functools
+import logging
+import logging.handlers
+import os
+import pickle
+import queue
+import sqlite3
+import time
+from collections import defaultdict
+import discord
+from discord.ext import commands, tasks
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Log through a queue so formatting and stream writes happen on a background
+# thread instead of blocking the event loop mid-raid
+_log_queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(_log_queue, logging.StreamHandler())
+_log_listener.start()
+log = logging.getLogger("secbot")
+log.addHandler(logging.handlers.QueueHandler(_log_queue))
+log.setLevel(logging.WARNING)
+
+# Security configurations
+ALERT_CHANNEL_NAME = "security-logs"
+BOT_INVITE_PROTECTION = True
+
+# Action types that trigger an auto-ban, and the subset that creates something we should delete
+_BAN_ACTIONS = frozenset({"channel_create", "role_create", "channel_delete", "role_delete", "bot_add"})
+_CREATE_ACTIONS = frozenset({"channel_create", "role_create"})
+
+# Alert embed skeleton, copied and filled in per event instead of rebuilt from scratch
+_ALERT_EMBED_TEMPLATE = {
+    "title": "🚨 Suspicious Activity Detected",
+    "color": discord.Color.red().value,
+}
+
+@functools.lru_cache(maxsize=16)
+def _action_title(action_type):
+    return action_type.replace('_', ' ').title()
+
+# Subscribe only to the gateway events we actually handle; Intents.all()
+# would stream presence/typing/voice updates we never read
+intents = discord.Intents.none()
+intents.guilds = True  # channel/role create and delete events
+intents.members = True  # on_member_join for bot-add protection
+intents.moderation = True  # ban/kick audit events
+intents.guild_messages = True  # prefix commands
+intents.message_content = True  # prefix commands read message text
+bot = commands.Bot(command_prefix='!', intents=intents)
+
+# Track permissions, activity, and whitelisted users
+original_permissions = {}
+user_activity = {}
+whitelisted_users = defaultdict(set)  # guild.id -> set of whitelisted user IDs
+_alert_channel_cache = {}  # guild.id -> alert channel, avoids rescanning text_channels per event
+_top_role_cache = {}  # (guild.id, user.id) -> (monotonic timestamp, top role position)
+_TOP_ROLE_TTL = 5.0  # seconds; raids fire many events from one user in a burst
+_action_bucket = {}  # (guild.id, user.id, action_type) -> monotonic timestamp of last response
+_ACTION_WINDOW = 10.0  # seconds; identical events inside the window coalesce to one response
+_BACKUP_MAX_AGE = 3600.0  # seconds; don't redo a backup that's fresher than this
+_audit_locks = {}  # guild.id -> asyncio.Lock serializing audit-log fetches
+_audit_recent = {}  # (guild.id, action value) -> (monotonic timestamp, entry)
+_AUDIT_CACHE_TTL = 1.0  # seconds; a burst of events shares one audit-log fetch
+_ACTIVITY_TTL = 3600.0  # seconds; activity records store time.monotonic() floats
+_CACHE_MAX_ENTRIES = 10_000  # cap on per-event caches so RSS stays bounded
+_guild_burst = {}  # guild.id -> (window start, structural-event count)
+_recent_suspicious = {}  # guild.id -> monotonic timestamp of last confirmed suspicious action
+_BURST_WINDOW = 10.0  # seconds over which structural events are counted
+_BURST_THRESHOLD = 2  # events within the window before we consult the audit log
+
+def _evict_oldest(cache):
+    """Drop oldest entries once a cache hits its size cap (dicts keep insertion order)"""
+    while len(cache) >= _CACHE_MAX_ENTRIES:
+        del cache[next(iter(cache))]
+
+# On-disk backup store so pre-raid permissions survive a restart
+_perms_db = sqlite3.connect('perms.db')
+_perms_db.execute(
+    "CREATE TABLE IF NOT EXISTS perms(guild_id INTEGER PRIMARY KEY, blob BLOB, ts REAL)"
+)
+_perms_db.commit()
+
+def _serialize_backup(data):
+    """Reduce a backup to plain values for the on-disk store"""
+    return {
+        'everyone': data['everyone'].value,
+        'channel_ids': data['channel_ids'],
+        'overwrites': data['overwrites'],
+    }
+
+def _deserialize_backup(payload):
+    """Rebuild a backup loaded from the on-disk store"""
+    return {
+        'everyone': discord.Permissions(payload['everyone']),
+        'channel_ids': payload['channel_ids'],
+        'overwrites': payload['overwrites'],
+    }
+
+async def backup_permissions(guild):
+    """Backup current permissions before making changes.
+
+    Overwrites are stored as a flat list of
+    (channel_id, target_id, is_role, allow_bits, deny_bits) tuples so the
+    restore path is a single linear scan instead of nested dict iteration,
+    and the payload serializes without holding live discord objects.
+    """
+    row = _perms_db.execute(
+        "SELECT blob, ts FROM perms WHERE guild_id = ?", (guild.id,)
+    ).fetchone()
+    if row and time.time() - row[1] < _BACKUP_MAX_AGE:
+        # A fresh backup already exists on disk. Prefer it over a live
+        # snapshot: if a raid straddled a restart, the current channel
+        # state is post-raid and must not clobber the pre-raid row.
+        if guild.id not in original_permissions:
+            original_permissions[guild.id] = _deserialize_backup(pickle.loads(row[0]))
+        return
+
+    overwrites = []
+    for channel in guild.text_channels:
+        for target, overwrite in channel.overwrites.items():
+            allow, deny = overwrite.pair()
+            overwrites.append(
+                (channel.id, target.id, isinstance(target, discord.Role), allow.value, deny.value)
+            )
+    original_permissions[guild.id] = {
+        'everyone': guild.default_role.permissions,
+        'channel_ids': [channel.id for channel in guild.text_channels],
+        'overwrites': overwrites,
+    }
+    _perms_db.execute(
+        "INSERT OR REPLACE INTO perms(guild_id, blob, ts) VALUES (?, ?, ?)",
+        (guild.id, pickle.dumps(_serialize_backup(original_permissions[guild.id])), time.time())
+    )
+    _perms_db.commit()
+
+async def restore_permissions(guild):
+    """Restore original permissions"""
+    if guild.id not in original_permissions:
+        return False
+
+    backup = original_permissions[guild.id]
+
+    try:
+        # Restore @everyone permissions first; channel edits depend on it
+        await guild.default_role.edit(permissions=backup['everyone'])
+
+        # Restore channel-specific permissions concurrently instead of
+        # serializing one REST round-trip per channel/target. A small
+        # semaphore keeps the burst under Discord's per-route rate limits.
+        semaphore = asyncio.Semaphore(5)
+
+        async def _limited(coro):
+            async with semaphore:
+                return await coro
+
+        # guild.get_channel is an O(1) dict lookup; iterating guild.text_channels
+        # would rebuild and filter the full channel list on every access
+        pending = []
+        for channel_id in backup['channel_ids']:
+            channel = guild.get_channel(channel_id)
+            if channel is not None:
+                pending.append(_limited(channel.edit(sync_permissions=True)))
+        for channel_id, target_id, is_role, allow, deny in backup['overwrites']:
+            channel = guild.get_channel(channel_id)
+            if channel is None:
+                continue
+            target = guild.get_role(target_id) if is_role else guild.get_member(target_id)
+            if target is None:
+                continue
+            overwrite = discord.PermissionOverwrite.from_pair(
+                discord.Permissions(allow), discord.Permissions(deny)
+            )
+            pending.append(_limited(channel.set_permissions(target, overwrite=overwrite)))
+
+        results = await asyncio.gather(*pending, return_exceptions=True)
+        for result in results:
+            if isinstance(result, Exception):
+                log.warning("Restore failed: %s", result)
+                return False
+
+        return True
+    except Exception:
+        log.warning("Restore failed", exc_info=True)
+        return False
+
+def _higher_than_bot(guild, user):
+    """Check role hierarchy, caching the user's top-role position briefly"""
+    key = (guild.id, user.id)
+    now = time.monotonic()
+    cached = _top_role_cache.get(key)
+    if cached and now - cached[0] < _TOP_ROLE_TTL:
+        position = cached[1]
+    else:
+        position = user.top_role.position
+        _evict_oldest(_top_role_cache)
+        _top_role_cache[key] = (now, position)
+    return position >= guild.me.top_role.position
+
+def _worth_audit_fetch(guild):
+    """Decide whether an event even warrants an audit-log request.
+
+    A lone channel or role change is almost always an admin working
+    normally; only a burst of structural events within a short window, or
+    a guild that was recently confirmed suspicious, justifies spending a
+    REST call on the audit log.
+    """
+    now = time.monotonic()
+    if now - _recent_suspicious.get(guild.id, 0) < _BURST_WINDOW:
+        return True
+    start, count = _guild_burst.get(guild.id, (now, 0))
+    if now - start >= _BURST_WINDOW:
+        start, count = now, 0
+    count += 1
+    _guild_burst[guild.id] = (start, count)
+    return count >= _BURST_THRESHOLD
+
+def is_whitelisted(guild, user):
+    """Check whether a user is exempt from suspicious-action handling"""
+    return user.id == guild.owner_id or user.id in whitelisted_users[guild.id]
+
+async def _first_audit_entry(guild, action=None):
+    """Fetch the most recent audit-log entry with a single await"""
+    iterator = guild.audit_logs(action=action, limit=1)
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
+
+async def fetch_audit_entry(guild, action, use_cache=True):
+    """Fetch the latest audit-log entry, coalescing concurrent requests per guild.
+
+    Twenty simultaneous delete events would otherwise fire twenty
+    overlapping audit-log requests; a per-guild lock plus a short cache
+    collapses them into one HTTP call. Create handlers pass
+    use_cache=False because each one must see the entry for its own
+    target — a cached entry would only match the first created object
+    and the rest would never be cleaned up.
+    """
+    key = (guild.id, action.value if action else -1)
+    if use_cache:
+        cached = _audit_recent.get(key)
+        if cached and time.monotonic() - cached[0] < _AUDIT_CACHE_TTL:
+            return cached[1]
+
+    lock = _audit_locks.setdefault(guild.id, asyncio.Lock())
+    async with lock:
+        if use_cache:
+            cached = _audit_recent.get(key)
+            if cached and time.monotonic() - cached[0] < _AUDIT_CACHE_TTL:
+                return cached[1]
+        entry = await _first_audit_entry(guild, action=action)
+        if use_cache:
+            _evict_oldest(_audit_recent)
+            _audit_recent[key] = (time.monotonic(), entry)
+        return entry
+
+async def get_alert_channel(guild):
+    """Get or create the alert channel"""
+    try:
+        alert_channel = _alert_channel_cache.get(guild.id)
+        if alert_channel and alert_channel.guild is guild:
+            return alert_channel
+
+        alert_channel = discord.utils.get(guild.text_channels, name=ALERT_CHANNEL_NAME)
+        if not alert_channel:
+            overwrites = {
+                guild.default_role: discord.PermissionOverwrite(read_messages=False),
+                guild.me: discord.PermissionOverwrite(read_messages=True)
+            }
+            alert_channel = await guild.create_text_channel(
+                ALERT_CHANNEL_NAME,
+                overwrites=overwrites,
+                reason="Security alert channel"
+            )
+        _alert_channel_cache[guild.id] = alert_channel
+        return alert_channel
+    except Exception:
+        log.warning("Error getting alert channel", exc_info=True)
+        return None
+
+async def secure_ban_and_restore(guild, user, reason):
+    """Ban user and restore server permissions"""
+    if guild.id not in original_permissions or not original_permissions[guild.id]:
+        await backup_permissions(guild)
+
+    try:
+        # Ensure bot is allowed to ban
+        if _higher_than_bot(guild, user):
+            return False, "User has higher role than the bot"
+
+        await guild.ban(user, reason=reason)
+
+        # Restore permissions after ban
+        restore_success = await restore_permissions(guild)
+        return True, f"Banned successfully. Server {'restored' if restore_success else 'restore failed'}"
+    
+    except Exception as e:
+        return False, f"Error: {str(e)}"
+
+async def handle_suspicious_action(guild, user, action_type, target=None):
+    """Process suspicious actions with auto-ban"""
+    if is_whitelisted(guild, user) or _higher_than_bot(guild, user):
+        return  # Ignore actions from server owner, whitelisted users, or users with higher roles
+
+    _recent_suspicious[guild.id] = time.monotonic()
+
+    # Coalesce raid bursts: respond once per window for identical events,
+    # but still clean up anything the attacker created in the meantime
+    key = (guild.id, user.id, action_type)
+    now = time.monotonic()
+    if now - _action_bucket.get(key, 0) < _ACTION_WINDOW:
+        if target and action_type in _CREATE_ACTIONS:
+            try:
+                await target.delete(reason="Suspicious creation")
+            except:
+                pass
+        return
+    _evict_oldest(_action_bucket)
+    _action_bucket[key] = now
+
+    # The ban doesn't depend on the alert channel, so run both concurrently
+    alert_task = asyncio.create_task(get_alert_channel(guild))
+    ban_task = None
+    if action_type in _BAN_ACTIONS:
+        ban_task = asyncio.create_task(
+            secure_ban_and_restore(guild, user, f"Suspicious: {action_type}")
+        )
+
+    try:
+        # Send alert
+        alert_channel = await alert_task
+        if alert_channel:
+            data = dict(_ALERT_EMBED_TEMPLATE)
+            data["description"] = f"Action: {_action_title(action_type)}"
+            data["fields"] = [{"name": "User", "value": f"{user.mention} ({user.id})", "inline": False}]
+            await alert_channel.send(embed=discord.Embed.from_dict(data))
+
+        # Ban the user
+        if ban_task:
+            success, msg = await ban_task
+            ban_task = None
+            if alert_channel:
+                await alert_channel.send(f"Action taken: {msg}")
+
+        # Delete suspicious channels/roles
+        if target and action_type in _CREATE_ACTIONS:
+            try:
+                await target.delete(reason="Suspicious creation")
+            except:
+                pass
+
+    except Exception:
+        log.warning("Error handling suspicious action", exc_info=True)
+    finally:
+        # If the alert path raised, the ban must still be collected: asyncio
+        # keeps only weak references to tasks, so an unawaited ban/restore
+        # could be garbage-collected before it completes
+        if ban_task:
+            try:
+                await ban_task
+            except Exception:
+                log.warning("Ban task failed", exc_info=True)
+
+@bot.event
+async def on_guild_channel_create(channel):
+    if not _worth_audit_fetch(channel.guild):
+        return
+    entry = await fetch_audit_entry(channel.guild, discord.AuditLogAction.channel_create, use_cache=False)
+    if entry and entry.target.id == channel.id:
+        await handle_suspicious_action(channel.guild, entry.user, "channel_create", channel)
+
+@bot.event
+async def on_guild_channel_delete(channel):
+    if channel.name == ALERT_CHANNEL_NAME:
+        _alert_channel_cache.pop(channel.guild.id, None)
+    if not _worth_audit_fetch(channel.guild):
+        return
+    entry = await fetch_audit_entry(channel.guild, discord.AuditLogAction.channel_delete)
+    if entry and getattr(entry.target, 'id', None) == channel.id:
+        await handle_suspicious_action(channel.guild, entry.user, "channel_delete")
+
+@bot.event
+async def on_guild_role_create(role):
+    if not _worth_audit_fetch(role.guild):
+        return
+    entry = await fetch_audit_entry(role.guild, discord.AuditLogAction.role_create, use_cache=False)
+    if entry and entry.target.id == role.id:
+        await handle_suspicious_action(role.guild, entry.user, "role_create", role)
+
+@bot.event
+async def on_guild_role_delete(role):
+    if not _worth_audit_fetch(role.guild):
+        return
+    entry = await fetch_audit_entry(role.guild, discord.AuditLogAction.role_delete)
+    if entry and getattr(entry.target, 'id', None) == role.id:
+        await handle_suspicious_action(role.guild, entry.user, "role_delete")
+
+@bot.event
+async def on_member_join(member):
+    # Cheapest check first: the vast majority of joins are humans
+    if not member.bot:
+        return
+    if member.id != bot.user.id or not BOT_INVITE_PROTECTION:
+        return
+    entry = await fetch_audit_entry(member.guild, discord.AuditLogAction.bot_add)
+    if entry:
+        await handle_suspicious_action(member.guild, entry.user, "bot_add")
+
+@bot.event
+async def on_guild_remove(guild):
+    # Drop every piece of per-guild state so departed guilds don't leak
+    _alert_channel_cache.pop(guild.id, None)
+    original_permissions.pop(guild.id, None)
+    whitelisted_users.pop(guild.id, None)
+    _audit_locks.pop(guild.id, None)
+    _guild_burst.pop(guild.id, None)
+    _recent_suspicious.pop(guild.id, None)
+    for key in [k for k in _audit_recent if k[0] == guild.id]:
+        del _audit_recent[key]
+    for key in [k for k in _top_role_cache if k[0] == guild.id]:
+        del _top_role_cache[key]
+    for key in [k for k in _action_bucket if k[0] == guild.id]:
+        del _action_bucket[key]
+
+@tasks.loop(minutes=30)
+async def cleanup_activity():
+    """Clean up old activity records"""
+    # Delete expired entries in place rather than rebuilding the whole dict
+    cutoff = time.monotonic() - _ACTIVITY_TTL
+    for user in list(user_activity):
+        acts = user_activity[user]
+        for act in [a for a, data in acts.items() if data['timestamp'] < cutoff]:
+            del acts[act]
+        if not acts:
+            del user_activity[user]
+    _top_role_cache.clear()
+    bucket_cutoff = time.monotonic() - _ACTION_WINDOW
+    for key in [k for k, ts in _action_bucket.items() if ts < bucket_cutoff]:
+        del _action_bucket[key]
+    burst_cutoff = time.monotonic() - _BURST_WINDOW
+    for guild_id in [g for g, (start, _) in _guild_burst.items() if start < burst_cutoff]:
+        del _guild_burst[guild_id]
+    for guild_id in [g for g, ts in _recent_suspicious.items() if ts < burst_cutoff]:
+        del _recent_suspicious[guild_id]
+
+@bot.event
+async def on_ready():
+    print(f'Security bot {bot.user.name} is online!')
+    # Reload pre-raid backups so a restart can't trick us into
+    # treating post-raid permissions as the originals
+    for guild_id, blob in _perms_db.execute("SELECT guild_id, blob FROM perms"):
+        guild = bot.get_guild(guild_id)
+        if guild and guild_id not in original_permissions:
+            original_permissions[guild_id] = _deserialize_backup(pickle.loads(blob))
+    cleanup_activity.start()
+    await bot.change_presence(activity=discord.Activity(
+        type=discord.ActivityType.watching,
+        name="for suspicious activity"
+    ))
+
+# Whitelist command (Only Server Owner Can Use It)
+@bot.command(name='whitelist')
+async def whitelist(ctx, member: discord.Member):
+    if ctx.author.id != ctx.guild.owner_id:
+        await ctx.send("❌ Only the server owner can whitelist users!")
+        return
+    
+    whitelisted_users[ctx.guild.id].add(member.id)
+    await ctx.send(f"✅ {member.mention} has been whitelisted!")
+
+# Unwhitelist command (Only Server Owner Can Use It)
+@bot.command(name='unwhitelist')
+async def unwhitelist(ctx, member: discord.Member):
+    if ctx.author.id != ctx.guild.owner_id:
+        await ctx.send("❌ Only the server owner can unwhitelist users!")
+        return
+    
+    whitelisted_users[ctx.guild.id].discard(member.id)
+    await ctx.send(f"✅ {member.mention} has been removed from the whitelist!")
+
+# Manual unlock command for server owner
+@bot.command(name='unlock')
+async def manual_unlock(ctx):
+    """Manually restore server permissions"""
+    if ctx.author.id != ctx.guild.owner_id:
+        await ctx.send("❌ Only the server owner can unlock the server!")
+        return
+
+    success = await restore_permissions(ctx.guild)
+    
+    if success:
+        await ctx.send("✅ Server permissions restored!")
+    else:
+        await ctx.send("❌ Failed to restore permissions! Check the bot's role & permissions.")
+
+if __name__ == '__main__':
+    try:
+        bot.run(os.getenv('DISCORD_TOKEN'))
+    except Exception:
+        log.error("Fatal error", exc_info=True)